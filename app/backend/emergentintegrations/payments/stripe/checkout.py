@@ -14,6 +14,7 @@ class StripeCheckout:
     async def handle_webhook(self, *args, **kwargs):
         class WebhookResponse:
             event_type = "checkout.session.completed"
+            event_id = "fake_event"
             session_id = "fake_session"
         return WebhookResponse()
 
@@ -18,19 +18,32 @@ COMO EDITAR:
 - Webhooks: Configurar stripe_webhook() (linha ~410)
 """
 
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Header, BackgroundTasks
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
+import atexit
 import logging
+import logging.handlers
+import queue
+import socket
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional, Dict
-import uuid
 from datetime import datetime, timezone, timedelta
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 import asyncio
+import heapq
+import orjson
+from functools import lru_cache
+from collections import OrderedDict
+from cachetools import TTLCache
+from secrets import randbelow
 from enum import Enum
 
 # ====================================
@@ -40,20 +53,82 @@ from enum import Enum
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configurar logging
+# Os handlers só colocam os registos numa fila; a escrita no stdout é feita
+# por uma thread separada (QueueListener), sem bloquear o event loop
+log_queue = queue.SimpleQueue()
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+)
+log_listener = logging.handlers.QueueListener(log_queue, log_stream_handler)
+log_queue_handler = logging.handlers.QueueHandler(log_queue)
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+# Logs do uvicorn (incluindo access log) passam pela mesma fila
+for uvicorn_logger_name in ("uvicorn", "uvicorn.access"):
+    logging.getLogger(uvicorn_logger_name).handlers = [log_queue_handler]
+log_listener.start()
+# Parar (e esvaziar a fila) só no fim do processo: o uvicorn ainda regista
+# mensagens depois do evento de shutdown da aplicação
+atexit.register(log_listener.stop)
+logger = logging.getLogger(__name__)
+
 # Conexão com MongoDB
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# 🔍 EDITAR AQUI: Para ajustar o pool de conexões à concorrência do servidor
+# (valores por worker; podem ser definidos no .env)
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 50))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 10))
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=30000,
+    waitQueueTimeoutMS=2000,
+    serverSelectionTimeoutMS=3000,
+    retryWrites=True,
+    # Compressão do protocolo, negociada com o servidor por ordem de
+    # preferência (zstd requer MongoDB >= 4.2; zlib é o fallback da stdlib)
+    compressors="zstd,snappy,zlib",
+    zlibCompressionLevel=3
+)
 db = client[os.environ['DB_NAME']]
 
 # Configuração Stripe (modo teste por padrão)
 # TODO: Para produção, usar STRIPE_LIVE_API_KEY
 stripe_api_key = os.environ.get('STRIPE_API_KEY')
 
+# Clientes Stripe reutilizados entre pedidos (evita criar conexões a cada chamada)
+stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
+
+# URL pública do site (ex.: https://lockit.exemplo.com). Se não definida,
+# usa-se o host de cada pedido para montar os URLs de retorno do Stripe
+public_base_url = os.environ.get('PUBLIC_BASE_URL')
+
+@lru_cache(maxsize=16)
+def get_checkout_urls(base_url: str):
+    """Retorna (host_url, success_url, cancel_url) para um base URL"""
+    host_url = base_url.rstrip('/')
+    return (
+        host_url,
+        f"{host_url}/payment-success?session_id={{CHECKOUT_SESSION_ID}}",
+        f"{host_url}/payment-cancelled"
+    )
+
+@lru_cache(maxsize=16)
+def get_stripe_checkout(host_url: str) -> StripeCheckout:
+    """Cliente Stripe com o webhook apontado para o host que recebeu o pedido"""
+    return StripeCheckout(
+        api_key=stripe_api_key,
+        webhook_url=f"{host_url}/api/webhook/stripe"
+    )
+
 # Criar aplicação FastAPI
 app = FastAPI(
     title="Luggage Storage API",
     description="API para sistema de cacifos automático",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse  # Serialização JSON com orjson (mais rápida)
 )
 
 # Router com prefixo /api (importante para Kubernetes ingress)
@@ -87,31 +162,55 @@ class PaymentStatus(str, Enum):
 # ====================================
 # 🔍 EDITAR AQUI: Para alterar os preços dos cacifos
 LOCKER_PRICES = {
-    LockerSize.SMALL: 2.0,   # €2.00 por 24 horas
-    LockerSize.MEDIUM: 3.0,  # €3.00 por 24 horas  
-    LockerSize.LARGE: 5.0    # €5.00 por 24 horas
+    "small": 2.0,   # €2.00 por 24 horas
+    "medium": 3.0,  # €3.00 por 24 horas
+    "large": 5.0    # €5.00 por 24 horas
 }
 
+# Tamanhos como strings simples (mesma ordem de LockerSize)
+LOCKER_SIZES = tuple(size.value for size in LockerSize)
+
+# Cache em memória da disponibilidade (evita contar cacifos a cada visita à homepage)
+# 🔍 EDITAR AQUI: Para alterar a validade do cache (em segundos)
+AVAILABILITY_CACHE_TTL = 2.0
+_avail_cache = TTLCache(maxsize=1, ttl=AVAILABILITY_CACHE_TTL)
+
+def invalidate_availability_cache():
+    """Força o recálculo da disponibilidade no próximo pedido"""
+    _avail_cache.clear()
+
 # ====================================
 # 🗄️ MODELOS DE DADOS (PYDANTIC)
 # ====================================
 
+# Os documentos usam o _id nativo do MongoDB (ObjectId, 12 bytes, sempre
+# indexado) como identificador; o _id não faz parte dos modelos.
+# use_enum_values só se aplica a valores validados: com validate_default,
+# também os defaults (ex.: payment_status=PENDING) saem do model_dump()
+# como strings simples.
+
 class Locker(BaseModel):
-    """Modelo de dados para um cacifo individual"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    """
+    Modelo de dados para um cacifo individual.
+    
+    Documenta o formato dos documentos em db.lockers; initialize_lockers()
+    monta esses documentos diretamente, sem instanciar o modelo.
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True, use_enum_values=True, validate_default=True)
     number: int                                    # Número físico do cacifo (1-24)
     size: LockerSize                              # Tamanho do cacifo
     status: LockerStatus = LockerStatus.AVAILABLE # Status atual
-    current_rental_id: Optional[str] = None       # ID do aluguel ativo (se houver)
+    current_rental_id: Optional[ObjectId] = None  # _id do aluguel ativo (se houver)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Rental(BaseModel):
     """Modelo de dados para um aluguel de cacifo"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    locker_id: str              # ID do cacifo alugado
+    model_config = ConfigDict(arbitrary_types_allowed=True, use_enum_values=True, validate_default=True)
+    locker_id: ObjectId         # _id do cacifo alugado
     locker_number: int          # Número físico do cacifo
     locker_size: LockerSize     # Tamanho do cacifo
     access_pin: str             # PIN de 6 dígitos para acesso
+    access_pin_int: int         # Mesmo PIN como inteiro (chave de índice menor)
     payment_session_id: Optional[str] = None  # ID da sessão Stripe
     payment_status: PaymentStatus = PaymentStatus.PENDING
     amount: float               # Valor pago em EUR
@@ -123,9 +222,9 @@ class Rental(BaseModel):
 
 class PaymentTransaction(BaseModel):
     """Modelo para registro de transações de pagamento"""
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    model_config = ConfigDict(arbitrary_types_allowed=True, use_enum_values=True, validate_default=True)
     session_id: str             # ID da sessão Stripe
-    rental_id: str              # ID do aluguel relacionado
+    rental_id: ObjectId         # _id do aluguel relacionado
     amount: float               # Valor da transação
     currency: str               # Moeda da transação
     payment_status: PaymentStatus
@@ -174,6 +273,9 @@ class UnlockResponse(BaseModel):
 # 🚀 INICIALIZAÇÃO DO SISTEMA
 # ====================================
 
+# Código de erro do MongoDB para violação de índice único
+DUPLICATE_KEY = 11000
+
 async def initialize_lockers():
     """
     🔍 EDITAR AQUI: Para alterar distribuição de cacifos
@@ -188,25 +290,187 @@ async def initialize_lockers():
     if existing_count > 0:
         return
     
-    lockers = []
-    for i in range(1, 25):  # Cacifos numerados de 1 a 24
-        if i <= 8:
-            size = LockerSize.SMALL     # Primeiros 8: pequenos
-        elif i <= 16:
-            size = LockerSize.MEDIUM    # Próximos 8: médios
-        else:
-            size = LockerSize.LARGE     # Últimos 8: grandes
-        
-        locker = Locker(number=i, size=size)
-        lockers.append(locker.dict())
+    sizes = (
+        [LockerSize.SMALL] * 8 +    # Cacifos 1-8: pequenos
+        [LockerSize.MEDIUM] * 8 +   # Cacifos 9-16: médios
+        [LockerSize.LARGE] * 8      # Cacifos 17-24: grandes
+    )
+
+    # Documentos montados diretamente (mesmos campos do modelo Locker),
+    # sem passar pela validação do Pydantic
+    now = datetime.now(timezone.utc)
+    lockers = [
+        {
+            "number": number,
+            "size": size.value,
+            "status": LockerStatus.AVAILABLE.value,
+            "current_rental_id": None,
+            "created_at": now
+        }
+        for number, size in enumerate(sizes, start=1)
+    ]
+
+    # Upsert por número: se outro worker estiver a inicializar em simultâneo,
+    # os cacifos que ele já criou não são duplicados (índice único em number)
+    try:
+        result = await db.lockers.bulk_write([
+            UpdateOne({"number": locker["number"]}, {"$setOnInsert": locker}, upsert=True)
+            for locker in lockers
+        ], ordered=False)
+        upserted_count = result.upserted_count
+    except BulkWriteError as e:
+        # Upserts simultâneos no mesmo número: o outro worker criou o cacifo
+        if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+            raise
+        upserted_count = e.details["nUpserted"]
+    if upserted_count:
+        logger.info("✅ Inicializados %d cacifos no sistema", upserted_count)
+
+# 🔍 EDITAR AQUI: Tempo de retenção dos eventos de webhook processados (em
+# segundos). O Stripe reenvia eventos durante até ~3 dias; a margem evita
+# que um reenvio tardio seja processado duas vezes.
+WEBHOOK_EVENT_RETENTION = 30 * 24 * 3600
+
+async def ensure_indexes():
+    """
+    Cria os índices usados pelas queries mais frequentes.
+
+    create_index é idempotente: se o índice já existir, nada é feito.
+    """
+    # Varredura de expiração em check_expired_rentals()
+    await db.rentals.create_index(
+        [("is_expired", 1), ("payment_status", 1), ("end_time", 1)],
+        name="expiry_sweep",
+        background=True
+    )
+    # Lookup por sessão Stripe em get_payment_status() e no webhook.
+    # Índice parcial (em vez de sparse) porque aluguéis pendentes guardam
+    # payment_session_id=None, e um índice sparse único indexaria esses nulos.
+    await db.rentals.create_index(
+        [("payment_session_id", 1)],
+        unique=True,
+        partialFilterExpression={"payment_session_id": {"$type": "string"}},
+        background=True
+    )
+    # Verificação de PIN em unlock_locker() (cobre todos os campos do filtro)
+    await db.rentals.create_index(
+        [("locker_number", 1), ("access_pin_int", 1), ("is_expired", 1), ("payment_status", 1)],
+        background=True
+    )
+    # Agregação de disponibilidade ($match por status, $group por size)
+    # e reserva de cacifo por tamanho em create_rental()
+    await db.lockers.create_index(
+        [("status", 1), ("size", 1)],
+        background=True
+    )
+    # Número físico do cacifo (unlock_locker liberta cacifos por número)
+    await db.lockers.create_index("number", unique=True, background=True)
+    # Atualização de transações por sessão Stripe (status e webhook)
+    await db.payment_transactions.create_index("session_id", unique=True, background=True)
+    # Idempotência do webhook Stripe
+    await db.processed_webhook_events.create_index("event_id", unique=True, background=True)
+    # Eventos antigos são removidos automaticamente pelo MongoDB (índice TTL)
+    await db.processed_webhook_events.create_index(
+        "received_at",
+        expireAfterSeconds=WEBHOOK_EVENT_RETENTION,
+        background=True
+    )
+
+# Código de erro do MongoDB ao remover um índice que não existe
+INDEX_NOT_FOUND = 27
+
+# Documento em db.meta com os nomes das migrações já aplicadas
+MIGRATIONS_ID = "migrations"
+
+async def migrate_legacy_ids():
+    """
+    Migra dados antigos que usavam um UUID no campo "id" como identificador.
+    
+    As referências (rentals.locker_id, lockers.current_rental_id e
+    payment_transactions.rental_id) passam a apontar para o _id ObjectId
+    dos documentos, e o campo "id" é removido. Idempotente.
+    """
+    legacy_lockers = await db.lockers.find({"id": {"$exists": True}}, {"_id": 1, "id": 1}).to_list(None)
+    legacy_rentals = await db.rentals.find({"id": {"$exists": True}}, {"_id": 1, "id": 1}).to_list(None)
+    if not legacy_lockers and not legacy_rentals:
+        return
+
+    if legacy_lockers:
+        await db.rentals.bulk_write([
+            UpdateMany({"locker_id": locker["id"]}, {"$set": {"locker_id": locker["_id"]}})
+            for locker in legacy_lockers
+        ], ordered=False)
+    if legacy_rentals:
+        await asyncio.gather(
+            db.lockers.bulk_write([
+                UpdateMany({"current_rental_id": rental["id"]}, {"$set": {"current_rental_id": rental["_id"]}})
+                for rental in legacy_rentals
+            ], ordered=False),
+            db.payment_transactions.bulk_write([
+                UpdateMany({"rental_id": rental["id"]}, {"$set": {"rental_id": rental["_id"]}})
+                for rental in legacy_rentals
+            ], ordered=False)
+        )
+
+    # O índice único antigo em lockers.id impediria remover o campo.
+    # Outro worker pode removê-lo em simultâneo: IndexNotFound é ignorado.
+    try:
+        await db.lockers.drop_index("id_1")
+    except OperationFailure as e:
+        if e.code != INDEX_NOT_FOUND:
+            raise
+    await asyncio.gather(*[
+        collection.update_many({"id": {"$exists": True}}, {"$unset": {"id": ""}})
+        for collection in (db.lockers, db.rentals, db.payment_transactions)
+    ])
+    logger.info("✅ Migrados %d cacifos e %d aluguéis para _id ObjectId", len(legacy_lockers), len(legacy_rentals))
+
+async def migrate_access_pin_int():
+    """Preenche access_pin_int nos aluguéis criados antes deste campo existir"""
+    await db.rentals.update_many(
+        {"access_pin_int": {"$exists": False}},
+        [{"$set": {"access_pin_int": {"$toInt": "$access_pin"}}}]
+    )
+
+async def run_migrations():
+    """
+    Executa as migrações de dados ainda não aplicadas.
     
-    await db.lockers.insert_many(lockers)
-    print(f"✅ Inicializados {len(lockers)} cacifos no sistema")
+    Cada migração faz uma varredura completa da coleção, por isso fica
+    registada em db.meta e não volta a correr nos arranques seguintes.
+    As migrações são idempotentes: se dois workers arrancarem em simultâneo
+    e ambos a executarem, o resultado é o mesmo.
+    """
+    migrations = {
+        "legacy_ids": migrate_legacy_ids,
+        "access_pin_int": migrate_access_pin_int,
+    }
+    marker = await db.meta.find_one({"_id": MIGRATIONS_ID}, {"applied": 1})
+    applied = set(marker.get("applied", [])) if marker else set()
+    for name, migrate in migrations.items():
+        if name in applied:
+            continue
+        await migrate()
+        await db.meta.update_one(
+            {"_id": MIGRATIONS_ID},
+            {"$addToSet": {"applied": name}},
+            upsert=True
+        )
 
 @app.on_event("startup")
 async def startup_event():
     """Executado quando o servidor inicia"""
+    # Python 3.12+: tasks que terminam sem suspender não passam pelo event loop
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    
+    # Abrir as conexões do pool antes de receber tráfego
+    await asyncio.gather(*[db.command("ping") for _ in range(MONGO_MIN_POOL_SIZE)])
+    # Índices antes dos dados: o índice único em lockers.number impede que
+    # workers a arrancar em simultâneo criem cacifos duplicados
+    await ensure_indexes()
     await initialize_lockers()
+    await run_migrations()
     # Iniciar task em background para verificar aluguéis expirados
     asyncio.create_task(check_expired_rentals())
 
@@ -214,47 +478,170 @@ async def startup_event():
 # ⏰ BACKGROUND TASKS
 # ====================================
 
+# Agenda de expirações: heap de (end_time, rental_id) ordenado pelo próximo
+# aluguel a expirar. A task acorda na hora certa em vez de varrer a cada minuto.
+expiry_heap = []
+expiry_event = asyncio.Event()
+
+# 🔍 EDITAR AQUI: Intervalo máximo entre verificações (em segundos).
+# Garante que aluguéis criados por outros workers também são libertados.
+EXPIRY_MAX_SLEEP = 300
+
+# Liderança entre workers (ver try_acquire_expiry_leadership). O lease dura
+# mais do que o intervalo máximo entre verificações, para o líder o renovar.
+EXPIRY_LEADER_ID = "expiry_leader"
+EXPIRY_LEADER_LEASE = 2 * EXPIRY_MAX_SLEEP
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def as_utc(value):
+    """MongoDB devolve datetimes sem timezone; são sempre UTC"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def schedule_expiry(end_time, rental_id):
+    """Agenda a verificação de expiração de um aluguel e acorda a task"""
+    heapq.heappush(expiry_heap, (as_utc(end_time), rental_id))
+    expiry_event.set()
+
+async def schedule_next_expiry_from_db():
+    """Agenda o próximo vencimento conhecido no banco (inclui outros workers)"""
+    next_rental = await db.rentals.find_one(
+        {"is_expired": False, "payment_status": PaymentStatus.SUCCESS},
+        {"_id": 1, "end_time": 1},
+        sort=[("end_time", 1)],
+        hint="expiry_sweep"
+    )
+    if next_rental:
+        heapq.heappush(expiry_heap, (as_utc(next_rental["end_time"]), next_rental["_id"]))
+
+async def release_expired_rentals(current_time):
+    """Marca como expirados os aluguéis vencidos e liberta os seus cacifos"""
+    # Buscar aluguéis que expiraram mas ainda não foram marcados como expirados
+    expired_rentals = await db.rentals.find({
+        "end_time": {"$lt": current_time},
+        "is_expired": False,
+        "payment_status": PaymentStatus.SUCCESS
+    }, {"_id": 1, "locker_number": 1}).hint("expiry_sweep").to_list(None)
+
+    if not expired_rentals:
+        return
+
+    rental_ids = [rental["_id"] for rental in expired_rentals]
+
+    # Marcar todos os aluguéis como expirados e liberar os cacifos que ainda
+    # lhes pertencem (duas escritas independentes, em paralelo)
+    await asyncio.gather(
+        db.rentals.update_many(
+            {"_id": {"$in": rental_ids}},
+            {"$set": {"is_expired": True}}
+        ),
+        db.lockers.update_many(
+            {"current_rental_id": {"$in": rental_ids}},
+            {"$set": {
+                "status": LockerStatus.AVAILABLE,
+                "current_rental_id": None
+            }}
+        )
+    )
+
+    invalidate_availability_cache()
+
+    for rental in expired_rentals:
+        logger.info("🔓 Aluguel expirado: Cacifo %s liberado automaticamente", rental["locker_number"])
+
+async def try_acquire_expiry_leadership(current_time):
+    """
+    Tenta obter (ou renovar) a liderança da verificação de expirações.
+    
+    Com vários workers, só o líder executa release_expired_rentals(). O
+    lease fica em db.meta e é renovado a cada verificação; se o líder parar,
+    outro worker assume quando o lease expirar.
+    """
+    try:
+        await db.meta.find_one_and_update(
+            {
+                "_id": EXPIRY_LEADER_ID,
+                "$or": [
+                    {"owner": WORKER_ID},
+                    {"expires_at": {"$lt": current_time}}
+                ]
+            },
+            {"$set": {
+                "owner": WORKER_ID,
+                "expires_at": current_time + timedelta(seconds=EXPIRY_LEADER_LEASE)
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # O documento existe e pertence a outro worker com lease válido
+        return False
+
+async def release_expiry_leadership():
+    """Liberta o lease para outro worker assumir de imediato"""
+    await db.meta.update_one(
+        {"_id": EXPIRY_LEADER_ID, "owner": WORKER_ID},
+        {"$set": {"expires_at": datetime.fromtimestamp(0, timezone.utc)}}
+    )
+
 async def check_expired_rentals():
     """
-    Task em background que roda constantemente para verificar e limpar aluguéis expirados.
+    Task em background que liberta os aluguéis expirados.
     
-    🔍 EDITAR AQUI: Para alterar frequência de verificação (atualmente 60 segundos)
+    Após cada verificação, agenda o próximo end_time conhecido no banco e
+    dorme até lá (expiry_heap), acordando antes se um novo aluguel for
+    agendado. Verifica pelo menos a cada EXPIRY_MAX_SLEEP segundos, e só o
+    worker líder (try_acquire_expiry_leadership) escreve no banco.
     """
+    next_sweep_at = datetime.now(timezone.utc)
     while True:
+        current_time = datetime.now(timezone.utc)
+
+        sweep_due = current_time >= next_sweep_at or (
+            expiry_heap and expiry_heap[0][0] <= current_time
+        )
+        if sweep_due:
+            try:
+                is_leader = await try_acquire_expiry_leadership(current_time)
+            except Exception as e:
+                logger.error("❌ Erro ao obter liderança da verificação de expirações: %s", e)
+                is_leader = False
+
+            swept = False
+            if is_leader:
+                try:
+                    await release_expired_rentals(current_time)
+                    swept = True
+                except Exception as e:
+                    logger.error("❌ Erro ao verificar aluguéis expirados: %s", e)
+
+            # Remover da agenda tudo o que já venceu
+            while expiry_heap and expiry_heap[0][0] <= current_time:
+                heapq.heappop(expiry_heap)
+
+            # Só reagendar a partir do banco se a verificação correu bem: após
+            # uma falha, o aluguel vencido voltaria à agenda com end_time no
+            # passado e a task repetiria a verificação sem pausa. Nesse caso
+            # tenta-se de novo na próxima verificação periódica.
+            if swept:
+                try:
+                    await schedule_next_expiry_from_db()
+                except Exception as e:
+                    logger.error("❌ Erro ao consultar próximo vencimento: %s", e)
+
+            next_sweep_at = current_time + timedelta(seconds=EXPIRY_MAX_SLEEP)
+
+        # Dormir até ao próximo vencimento ou à próxima verificação periódica.
+        # Um novo agendamento (expiry_event) acorda a task só para recalcular.
+        wake_at = next_sweep_at
+        if expiry_heap:
+            wake_at = min(wake_at, expiry_heap[0][0])
+        timeout = max(0.0, (wake_at - datetime.now(timezone.utc)).total_seconds())
+
+        expiry_event.clear()
         try:
-            current_time = datetime.now(timezone.utc)
-            
-            # Buscar aluguéis que expiraram mas ainda não foram marcados como expirados
-            expired_rentals = await db.rentals.find({
-                "end_time": {"$lt": current_time},
-                "is_expired": False,
-                "payment_status": PaymentStatus.SUCCESS
-            }).to_list(None)
-            
-            for rental in expired_rentals:
-                # Marcar aluguel como expirado
-                await db.rentals.update_one(
-                    {"id": rental["id"]},
-                    {"$set": {"is_expired": True}}
-                )
-                
-                # Liberar o cacifo
-                await db.lockers.update_one(
-                    {"id": rental["locker_id"]},
-                    {"$set": {
-                        "status": LockerStatus.AVAILABLE,
-                        "current_rental_id": None
-                    }}
-                )
-                
-                print(f"🔓 Aluguel expirado: Cacifo {rental['locker_number']} liberado automaticamente")
-        
-        except Exception as e:
-            print(f"❌ Erro ao verificar aluguéis expirados: {e}")
-        
-        # Aguardar 60 segundos antes da próxima verificação
-        # 🔍 EDITAR AQUI: Para alterar frequência (em segundos)
-        await asyncio.sleep(60)
+            await asyncio.wait_for(expiry_event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
 
 # ====================================
 # 🛠️ FUNÇÕES UTILITÁRIAS
@@ -266,8 +653,55 @@ def generate_pin():
     
     🔍 EDITAR AQUI: Para alterar formato do PIN (atualmente 6 dígitos)
     """
-    import random
-    return f"{random.randint(100000, 999999)}"
+    # secrets: gerador criptograficamente seguro (PIN não previsível)
+    return f"{100000 + randbelow(900000)}"
+
+def pin_to_int(pin):
+    """
+    Converte o PIN digitado para inteiro (formato guardado em access_pin_int).
+    
+    Retorna None se o texto não for exatamente um PIN no formato de
+    generate_pin() (6 dígitos ASCII, sem zero à esquerda), para não aceitar
+    variantes (" 123456", "0123456", "12²") nem inteiros fora do int64 do BSON.
+    """
+    if not (len(pin) == 6 and pin.isascii() and pin.isdecimal() and pin[0] != "0"):
+        return None
+    return int(pin)
+
+async def stream_json_array(cursor):
+    """
+    Serializa um cursor MongoDB como array JSON, documento a documento.
+    
+    Evita carregar a coleção inteira em memória antes de responder.
+    """
+    yield b"["
+    first = True
+    async for doc in cursor:
+        if not first:
+            yield b","
+        yield orjson.dumps(doc, default=str)
+        first = False
+    yield b"]"
+
+# IDs de eventos de webhook já processados por este worker (o Stripe reenvia
+# eventos em caso de timeout ou erro). LRU limitado para não crescer
+# indefinidamente; a fonte de verdade é a coleção processed_webhook_events.
+WEBHOOK_DEDUP_MAX_EVENTS = 10_000
+_processed_webhook_events = OrderedDict()
+
+def webhook_already_processed(event_id):
+    """Verifica se o evento já foi processado por este worker"""
+    if event_id in _processed_webhook_events:
+        _processed_webhook_events.move_to_end(event_id)
+        return True
+    return False
+
+def mark_webhook_processed(event_id):
+    """Regista o evento como processado, descartando os mais antigos"""
+    _processed_webhook_events[event_id] = True
+    _processed_webhook_events.move_to_end(event_id)
+    while len(_processed_webhook_events) > WEBHOOK_DEDUP_MAX_EVENTS:
+        _processed_webhook_events.popitem(last=False)
 
 # ====================================
 # 🔌 ENDPOINTS DA API
@@ -288,21 +722,27 @@ async def get_locker_availability():
     
     Used by: Homepage do frontend para exibir cards de seleção
     """
-    availability = []
-    
-    for size in LockerSize:
-        # Contar cacifos disponíveis deste tamanho
-        available_count = await db.lockers.count_documents({
-            "size": size,
-            "status": LockerStatus.AVAILABLE
-        })
-        
-        availability.append(LockerAvailability(
+    cached = _avail_cache.get("availability")
+    if cached is not None:
+        return cached
+
+    # Contar cacifos disponíveis de todos os tamanhos numa só agregação
+    pipeline = [
+        {"$match": {"status": LockerStatus.AVAILABLE}},
+        {"$group": {"_id": "$size", "count": {"$sum": 1}}}
+    ]
+    counts = {doc["_id"]: doc["count"] async for doc in db.lockers.aggregate(pipeline)}
+
+    availability = [
+        LockerAvailability(
             size=size,
-            available_count=available_count,
+            available_count=counts.get(size, 0),
             price_per_24h=LOCKER_PRICES[size]
-        ))
-    
+        )
+        for size in LOCKER_SIZES
+    ]
+
+    _avail_cache["availability"] = availability
     return availability
 
 @api_router.post("/rentals", response_model=RentalResponse)
@@ -311,20 +751,32 @@ async def create_rental(request: RentalRequest, http_request: Request):
     🆕 ENDPOINT: Criar novo aluguel de cacifo
     
     Processo:
-    1. Verificar disponibilidade
-    2. Reservar cacifo temporariamente  
-    3. Criar registro de aluguel
-    4. Gerar sessão de pagamento Stripe
-    5. Retornar URL de checkout
+    1. Reservar cacifo disponível (operação atómica)
+    2. Gerar sessão de pagamento Stripe
+    3. Criar registro de aluguel (já com o ID da sessão)
+    4. Retornar URL de checkout
     
     Used by: Frontend quando usuário clica "Alugar Cacifo"
     """
     
-    # 1. Verificar se há cacifos disponíveis do tamanho solicitado
-    available_locker = await db.lockers.find_one({
-        "size": request.locker_size,
-        "status": LockerStatus.AVAILABLE
-    })
+    # ID gerado antes da reserva para ser gravado no cacifo na mesma operação
+    rental_id = ObjectId()
+    
+    # 1. Reservar um cacifo disponível do tamanho solicitado.
+    # find_one_and_update é atómico: dois pedidos simultâneos nunca
+    # reservam o mesmo cacifo (será confirmado após pagamento)
+    available_locker = await db.lockers.find_one_and_update(
+        {
+            "size": request.locker_size,
+            "status": LockerStatus.AVAILABLE
+        },
+        {"$set": {
+            "status": LockerStatus.OCCUPIED,
+            "current_rental_id": rental_id
+        }},
+        projection={"_id": 1, "number": 1},
+        return_document=ReturnDocument.AFTER
+    )
     
     if not available_locker:
         raise HTTPException(
@@ -332,74 +784,87 @@ async def create_rental(request: RentalRequest, http_request: Request):
             detail=f"Não há cacifos {request.locker_size} disponíveis no momento"
         )
     
-    # 2. Criar dados do aluguel
-    rental = Rental(
-        locker_id=available_locker["id"],
-        locker_number=available_locker["number"],
-        locker_size=request.locker_size,
-        access_pin=generate_pin(),
-        amount=LOCKER_PRICES[request.locker_size],
-        end_time=datetime.now(timezone.utc) + timedelta(hours=24)  # 24h de uso
-    )
-    
-    # 3. Reservar cacifo temporariamente (será confirmado após pagamento)
-    await db.lockers.update_one(
-        {"id": available_locker["id"]},
-        {"$set": {
-            "status": LockerStatus.OCCUPIED,
-            "current_rental_id": rental.id
-        }}
-    )
-    
-    # 4. Salvar aluguel no banco
-    await db.rentals.insert_one(rental.dict())
+    access_pin = generate_pin()
+    amount = LOCKER_PRICES[request.locker_size.value]
     
-    # 5. Criar sessão de pagamento Stripe
-    host_url = str(http_request.base_url).rstrip('/')
-    success_url = f"{host_url}/payment-success?session_id={{CHECKOUT_SESSION_ID}}"
-    cancel_url = f"{host_url}/payment-cancelled"
-    
-    stripe_checkout = StripeCheckout(
-        api_key=stripe_api_key,
-        webhook_url=f"{host_url}/api/webhook/stripe"
+    # 2. Criar sessão de pagamento Stripe
+    host_url, success_url, cancel_url = get_checkout_urls(
+        public_base_url or str(http_request.base_url)
     )
     
     checkout_request = CheckoutSessionRequest(
-        amount=rental.amount,
+        amount=amount,
         currency="EUR",
         success_url=success_url,
         cancel_url=cancel_url,
         metadata={
-            "rental_id": rental.id,
-            "locker_number": str(rental.locker_number),
-            "access_pin": rental.access_pin
+            "rental_id": str(rental_id),
+            "locker_number": str(available_locker["number"]),
+            "access_pin": access_pin
         }
     )
     
-    session = await stripe_checkout.create_checkout_session(checkout_request)
-    
-    # 6. Atualizar aluguel com ID da sessão Stripe
-    await db.rentals.update_one(
-        {"id": rental.id},
-        {"$set": {"payment_session_id": session.session_id}}
-    )
-    
-    # 7. Criar registro de transação
-    transaction = PaymentTransaction(
-        session_id=session.session_id,
-        rental_id=rental.id,
-        amount=rental.amount,
-        currency=rental.currency,
-        payment_status=PaymentStatus.PENDING,
-        metadata=checkout_request.metadata
-    )
-    
-    await db.payment_transactions.insert_one(transaction.dict())
+    session = None
+    try:
+        session = await get_stripe_checkout(host_url).create_checkout_session(checkout_request)
+        
+        # 3. Criar dados do aluguel e da transação
+        rental = Rental(
+            locker_id=available_locker["_id"],
+            locker_number=available_locker["number"],
+            locker_size=request.locker_size,
+            access_pin=access_pin,
+            access_pin_int=int(access_pin),
+            payment_session_id=session.session_id,
+            amount=amount,
+            end_time=datetime.now(timezone.utc) + timedelta(hours=24)  # 24h de uso
+        )
+        
+        transaction = PaymentTransaction(
+            session_id=session.session_id,
+            rental_id=rental_id,
+            amount=rental.amount,
+            currency=rental.currency,
+            payment_status=PaymentStatus.PENDING,
+            metadata=checkout_request.metadata
+        )
+        
+        # 4. Salvar aluguel e transação no banco
+        # (escritas independentes, executadas em paralelo)
+        await asyncio.gather(
+            db.rentals.insert_one({"_id": rental_id, **rental.model_dump()}),
+            db.payment_transactions.insert_one(transaction.model_dump())
+        )
+    except Exception:
+        # Stripe ou escrita no banco falhou: devolver o cacifo reservado e
+        # remover o que tiver sido gravado (uma das escritas pode ter corrido
+        # bem). Sem isto o cacifo ficaria ocupado por um aluguel inexistente,
+        # que a verificação de expirações nunca liberta.
+        cleanup = [
+            db.lockers.update_one(
+                {"_id": available_locker["_id"], "current_rental_id": rental_id},
+                {"$set": {
+                    "status": LockerStatus.AVAILABLE,
+                    "current_rental_id": None
+                }}
+            )
+        ]
+        if session is not None:
+            cleanup += [
+                db.rentals.delete_one({"_id": rental_id}),
+                db.payment_transactions.delete_one({"session_id": session.session_id})
+            ]
+        await asyncio.gather(*cleanup)
+        raise
     
-    print(f"✅ Aluguel criado: Cacifo {rental.locker_number}, PIN: {rental.access_pin}")
+    logger.info("✅ Aluguel criado: Cacifo %s, PIN: %s", rental.locker_number, rental.access_pin)
+
+    schedule_expiry(rental.end_time, rental_id)
+
+    invalidate_availability_cache()
     
     return RentalResponse(
-        rental_id=rental.id,
+        rental_id=str(rental_id),
         checkout_url=session.url,
         session_id=session.session_id
     )
@@ -415,41 +880,47 @@ async def get_payment_status(session_id: str):
     Used by: Frontend após retorno do Stripe (polling)
     """
     
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-    
     try:
         # Consultar status no Stripe
         status_response = await stripe_checkout.get_checkout_status(session_id)
         
-        # Buscar aluguel relacionado
-        rental = await db.rentals.find_one({"payment_session_id": session_id})
-        if not rental:
-            raise HTTPException(status_code=404, detail="Aluguel não encontrado")
+        is_paid = status_response.payment_status == "paid"
         
         # Atualizar transação no banco
-        await db.payment_transactions.update_one(
+        transaction_update = db.payment_transactions.update_one(
             {"session_id": session_id},
             {"$set": {
-                "payment_status": PaymentStatus.SUCCESS if status_response.payment_status == "paid" else PaymentStatus.PENDING,
+                "payment_status": PaymentStatus.SUCCESS if is_paid else PaymentStatus.PENDING,
                 "updated_at": datetime.now(timezone.utc)
             }}
         )
         
-        # Se pagamento aprovado, ativar aluguel
-        if status_response.payment_status == "paid":
-            await db.rentals.update_one(
-                {"id": rental["id"]},
-                {"$set": {"payment_status": PaymentStatus.SUCCESS}}
+        # Buscar aluguel relacionado; se pagamento aprovado, ativá-lo
+        # na mesma operação (em paralelo com a transação)
+        rental_projection = {"_id": 1, "locker_number": 1, "access_pin": 1, "end_time": 1}
+        if is_paid:
+            rental_lookup = db.rentals.find_one_and_update(
+                {"payment_session_id": session_id},
+                {"$set": {"payment_status": PaymentStatus.SUCCESS}},
+                projection=rental_projection,
+                return_document=ReturnDocument.AFTER
             )
-            
-            print(f"✅ Pagamento aprovado: Cacifo {rental['locker_number']}, PIN: {rental['access_pin']}")
+        else:
+            rental_lookup = db.rentals.find_one({"payment_session_id": session_id}, rental_projection)
+        
+        _, rental = await asyncio.gather(transaction_update, rental_lookup)
+        if not rental:
+            raise HTTPException(status_code=404, detail="Aluguel não encontrado")
+        
+        if is_paid:
+            logger.info("✅ Pagamento aprovado: Cacifo %s, PIN: %s", rental["locker_number"], rental["access_pin"])
             
             return {
                 "payment_status": "paid",
-                "rental_id": rental["id"],
+                "rental_id": str(rental["_id"]),
                 "locker_number": rental["locker_number"],
                 "access_pin": rental["access_pin"],
-                "end_time": rental["end_time"].isoformat()
+                "end_time": rental["end_time"]
             }
         
         return {
@@ -472,29 +943,36 @@ async def unlock_locker(request: UnlockRequest):
     Used by: Terminal de desbloqueio no frontend
     """
     
-    # Buscar aluguel ativo com PIN e número do cacifo corretos
-    rental = await db.rentals.find_one({
-        "locker_number": request.locker_number,
-        "access_pin": request.access_pin,
-        "payment_status": PaymentStatus.SUCCESS,
-        "is_expired": False
-    })
-    
-    if not rental:
+    pin_int = pin_to_int(request.access_pin)
+    if pin_int is None:
         return UnlockResponse(
             success=False,
             message="Código PIN inválido ou cacifo não encontrado"
         )
     
-    # Verificar se não expirou (dupla verificação)
+    # Buscar aluguel ativo com PIN e número do cacifo corretos.
+    # Numa só operação, o servidor marca o aluguel como expirado se o
+    # end_time já passou (dupla verificação com check_expired_rentals)
     current_time = datetime.now(timezone.utc)
-    if current_time > rental["end_time"]:
-        # Marcar como expirado
-        await db.rentals.update_one(
-            {"id": rental["id"]},
-            {"$set": {"is_expired": True}}
+    rental = await db.rentals.find_one_and_update(
+        {
+            "locker_number": request.locker_number,
+            "access_pin_int": pin_int,
+            "payment_status": PaymentStatus.SUCCESS,
+            "is_expired": False
+        },
+        [{"$set": {"is_expired": {"$lt": ["$end_time", current_time]}}}],
+        projection={"_id": 0, "is_expired": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    
+    if not rental:
+        return UnlockResponse(
+            success=False,
+            message="Código PIN inválido ou cacifo não encontrado"
         )
-        
+    
+    if rental["is_expired"]:
         # Liberar cacifo
         await db.lockers.update_one(
             {"number": request.locker_number},
@@ -503,6 +981,7 @@ async def unlock_locker(request: UnlockRequest):
                 "current_rental_id": None
             }}
         )
+        invalidate_availability_cache()
         
         return UnlockResponse(
             success=False,
@@ -514,7 +993,7 @@ async def unlock_locker(request: UnlockRequest):
     # =====================================
     
     # SIMULAÇÃO (atual):
-    print(f"🔓 HARDWARE: Desbloqueando cacifo {request.locker_number}")
+    logger.info("🔓 HARDWARE: Desbloqueando cacifo %s", request.locker_number)
     
     # TODO: Implementar controle real via Raspberry Pi GPIO
     # Exemplo de implementação real:
@@ -535,13 +1014,13 @@ async def unlock_locker(request: UnlockRequest):
     #     GPIO.cleanup()
     #     
     # except Exception as e:
-    #     print(f"❌ Erro no hardware: {e}")
+    #     logger.error("❌ Erro no hardware: %s", e)
     #     return UnlockResponse(
     #         success=False,
     #         message="Erro no sistema de desbloqueio"
     #     )
     
-    print(f"✅ Cacifo {request.locker_number} desbloqueado com sucesso")
+    logger.info("✅ Cacifo %s desbloqueado com sucesso", request.locker_number)
     
     return UnlockResponse(
         success=True,
@@ -549,8 +1028,39 @@ async def unlock_locker(request: UnlockRequest):
         locker_number=request.locker_number
     )
 
+async def apply_webhook_payment(session_id, event_id):
+    """
+    Confirma o pagamento de uma sessão Stripe recebida via webhook.
+    
+    Executado em background (após a resposta ao Stripe), por isso os erros
+    são apenas registados no log.
+    """
+    try:
+        # Atualizar transação e ativar aluguel (em paralelo)
+        await asyncio.gather(
+            db.payment_transactions.update_one(
+                {"session_id": session_id},
+                {"$set": {
+                    "payment_status": PaymentStatus.SUCCESS,
+                    "updated_at": datetime.now(timezone.utc)
+                }}
+            ),
+            db.rentals.update_one(
+                {"payment_session_id": session_id},
+                {"$set": {"payment_status": PaymentStatus.SUCCESS}}
+            )
+        )
+        
+        logger.info("✅ Webhook: Pagamento confirmado para sessão %s", session_id)
+    
+    except Exception as e:
+        logger.error("❌ Erro ao processar webhook da sessão %s: %s", session_id, e)
+        # Esquecer o evento para que um reenvio do Stripe volte a processá-lo
+        _processed_webhook_events.pop(event_id, None)
+        await db.processed_webhook_events.delete_one({"event_id": event_id})
+
 @api_router.post("/webhook/stripe")
-async def stripe_webhook(request: Request, stripe_signature: str = Header(None)):
+async def stripe_webhook(request: Request, background_tasks: BackgroundTasks, stripe_signature: str = Header(None)):
     """
     🪝 ENDPOINT: Webhook do Stripe
     
@@ -558,38 +1068,45 @@ async def stripe_webhook(request: Request, stripe_signature: str = Header(None))
     Importante para garantir que o sistema seja atualizado mesmo se o usuário
     fechar o browser durante o pagamento.
     
+    Cada evento é registado em processed_webhook_events (índice único em
+    event_id), por isso reenvios do Stripe não repetem as escritas. As
+    escritas no banco correm em background (apply_webhook_payment) para o
+    Stripe não reenviar o evento por timeout.
+    
     🔍 EDITAR AQUI: Para adicionar outros tipos de eventos do Stripe
     """
     
     body = await request.body()
     
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-    
     try:
         webhook_response = await stripe_checkout.handle_webhook(body, stripe_signature)
         
         if webhook_response.event_type == "checkout.session.completed":
-            # Atualizar transação
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "payment_status": PaymentStatus.SUCCESS,
-                    "updated_at": datetime.now(timezone.utc)
-                }}
-            )
+            event_id = webhook_response.event_id
             
-            # Ativar aluguel
-            await db.rentals.update_one(
-                {"payment_session_id": webhook_response.session_id},
-                {"$set": {"payment_status": PaymentStatus.SUCCESS}}
-            )
+            # Ignorar reenvios já vistos por este worker
+            if webhook_already_processed(event_id):
+                return {"status": "already_processed"}
+            
+            # Registar o evento; o índice único rejeita reenvios (todos os workers)
+            try:
+                await db.processed_webhook_events.insert_one({
+                    "event_id": event_id,
+                    "event_type": webhook_response.event_type,
+                    "session_id": webhook_response.session_id,
+                    "received_at": datetime.now(timezone.utc)
+                })
+            except DuplicateKeyError:
+                mark_webhook_processed(event_id)
+                return {"status": "already_processed"}
             
-            print(f"✅ Webhook: Pagamento confirmado para sessão {webhook_response.session_id}")
+            mark_webhook_processed(event_id)
+            background_tasks.add_task(apply_webhook_payment, webhook_response.session_id, event_id)
         
         return {"status": "success"}
     
     except Exception as e:
-        print(f"❌ Erro no webhook: {e}")
+        logger.error("❌ Erro no webhook: %s", e)
         return {"status": "error", "message": str(e)}
 
 # ====================================
@@ -603,18 +1120,63 @@ async def get_all_lockers():
     
     🔍 EDITAR AQUI: Para adicionar autenticação admin
     """
-    lockers = await db.lockers.find({}, {"_id": 0}).to_list(None)
-    return lockers
+    cursor = db.lockers.aggregate([
+        {"$project": {
+            "_id": 0,
+            "id": {"$toString": "$_id"},
+            "number": 1,
+            "size": 1,
+            "status": 1,
+            "current_rental_id": {"$toString": "$current_rental_id"},
+            "created_at": 1
+        }}
+    ], batchSize=500)
+    return StreamingResponse(stream_json_array(cursor), media_type="application/json")
+
+# 🔍 EDITAR AQUI: Para alterar o tamanho máximo de página
+ADMIN_RENTALS_MAX_LIMIT = 500
 
 @api_router.get("/admin/rentals")
-async def get_all_rentals():
+async def get_all_rentals(limit: int = 100, before: Optional[str] = None):
     """
-    👑 ADMIN: Listar todos os aluguéis
+    👑 ADMIN: Listar aluguéis, paginados do mais recente para o mais antigo
+    
+    Paginação por cursor (keyset) no _id: o ObjectId começa pelo instante de
+    criação e é único, por isso a ordem é estável e nenhum aluguel é saltado
+    entre páginas. Para obter a página seguinte, passar o valor de "next"
+    como parâmetro "before".
     
     🔍 EDITAR AQUI: Para adicionar autenticação admin
     """
-    rentals = await db.rentals.find({}, {"_id": 0}).to_list(None)
-    return rentals
+    if before is not None and not ObjectId.is_valid(before):
+        raise HTTPException(status_code=400, detail="Parâmetro before inválido")
+    query = {"_id": {"$lt": ObjectId(before)}} if before else {}
+    limit = max(1, min(limit, ADMIN_RENTALS_MAX_LIMIT))
+    rentals = await db.rentals.aggregate([
+        {"$match": query},
+        {"$sort": {"_id": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "id": {"$toString": "$_id"},
+            "locker_id": {"$toString": "$locker_id"},
+            "locker_number": 1,
+            "locker_size": 1,
+            "access_pin": 1,
+            "payment_session_id": 1,
+            "payment_status": 1,
+            "amount": 1,
+            "currency": 1,
+            "start_time": 1,
+            "end_time": 1,
+            "is_expired": 1,
+            "created_at": 1
+        }}
+    ]).to_list(limit)
+    return ORJSONResponse(content={
+        "items": rentals,
+        "next": rentals[-1]["id"] if len(rentals) == limit else None
+    })
 
 # ====================================
 # 🌐 CONFIGURAÇÃO FINAL DA APLICAÇÃO
@@ -632,18 +1194,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
 @app.on_event("shutdown")
 async def shutdown_db_client():
     """Executado quando o servidor é desligado"""
+    try:
+        await release_expiry_leadership()
+    except Exception as e:
+        logger.error("❌ Erro ao libertar liderança: %s", e)
     client.close()
-    print("🔌 Conexão com MongoDB fechada")
+    logger.info("🔌 Conexão com MongoDB fechada")
 
 # ====================================
 # 🏁 FIM DO ARQUIVO
@@ -157,10 +157,11 @@ class LuggageStorageAPITester:
             200
         )
         
-        if success2 and isinstance(rentals, list):
-            print(f"   Total rentals in system: {len(rentals)}")
+        if success2 and isinstance(rentals, dict):
+            rentals = rentals.get('items', [])
+            print(f"   Rentals in first page: {len(rentals)}")
             if rentals:
-                recent_rental = rentals[-1]
+                recent_rental = rentals[0]
                 print(f"   Most recent rental: Locker {recent_rental.get('locker_number')} - Status: {recent_rental.get('payment_status')}")
         
         return success1 and success2
@@ -0,0 +1,39 @@
+"""
+Testes de pin_to_int (validação do PIN recebido em /api/lockers/unlock).
+"""
+
+import os
+import sys
+import unittest
+from pathlib import Path
+
+# server.py lê a configuração do MongoDB ao ser importado (o cliente Motor
+# só conecta no primeiro pedido, por isso não é preciso um servidor real)
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "app" / "backend"))
+
+from server import generate_pin, pin_to_int  # noqa: E402
+
+
+class PinToIntTest(unittest.TestCase):
+    def test_generated_pins_are_accepted(self):
+        for _ in range(100):
+            pin = generate_pin()
+            self.assertEqual(pin_to_int(pin), int(pin))
+
+    def test_non_canonical_pins_are_rejected(self):
+        for pin in ["", "12345", "1234567", " 123456", "123456 ", "012345", "+12345", "12 456"]:
+            self.assertIsNone(pin_to_int(pin), pin)
+
+    def test_unicode_digits_are_rejected(self):
+        for pin in ["²", "12²", "12345²", "١٢٣٤٥٦", "１２３４５６"]:
+            self.assertIsNone(pin_to_int(pin), pin)
+
+    def test_out_of_range_pins_are_rejected(self):
+        for pin in ["12345678901234567890", "9" * 30]:
+            self.assertIsNone(pin_to_int(pin), pin)
+
+
+if __name__ == "__main__":
+    unittest.main()